@@ -6,10 +6,35 @@ Provides camera preview and photo capture functionality with GPIO button support
 
 import time
 import os
+import queue
+import itertools
+import logging
+import logging.handlers
 import threading
-from datetime import datetime
+import numpy as np
 from picamera2 import Picamera2, Preview
-import RPi.GPIO as GPIO
+from PIL import Image
+import pigpio
+
+# Optional: libjpeg-turbo bindings for NEON-accelerated JPEG encoding
+# (3-5x faster than the stock PIL encoder on a 12MP frame). Falls back
+# to picamera2's default encoder when unavailable.
+try:
+    from turbojpeg import TurboJPEG, TJPF_RGB
+except ImportError:
+    TurboJPEG = None
+
+# Optional: io_uring bindings so a burst's fdatasync calls go to the
+# kernel as one batched submission instead of one syscall per file.
+# Falls back to plain fdatasync when unavailable.
+try:
+    import liburing
+except ImportError:
+    liburing = None
+
+logger = logging.getLogger("picam")
+
+_MB = 1024 * 1024
 
 
 class PiCameraController:
@@ -17,25 +42,73 @@ class PiCameraController:
     Raspberry Pi Camera Controller with GPIO button support
     """
     
-    def __init__(self, button_pin=0, preview_size=(1640, 1232), still_size=(4056, 3040)):
+    def __init__(self, button_pin=0, preview_size=(1640, 1232), still_size=(4056, 3040),
+                 sync_every=8, enable_lores=False):
         """
         Initialize the camera controller
-        
+
         Args:
             button_pin (int): GPIO pin number for shutter button (default: 0)
             preview_size (tuple): Preview resolution (width, height)
             still_size (tuple): Still capture resolution (width, height)
+            sync_every (int): Max photos written before forcing an fdatasync.
+                Batching the sync amortizes SD-card flush latency across a
+                burst, at the cost of a slightly larger power-loss window.
+            enable_lores (bool): Add a 640x480 YUV420 lores stream to the
+                preview config. Off by default - nothing here consumes it,
+                and an unread stream costs ISP downscale work and DRAM
+                bandwidth on every preview frame.
         """
         self.button_pin = button_pin
         self.preview_size = preview_size
         self.still_size = still_size
+        self.sync_every = sync_every
+        self.enable_lores = enable_lores
         self.photos_dir = "photos"
+
+        # Filename template, hoisted out of the shutter path; the shot
+        # sequence number keeps burst captures in the same second unique.
+        # itertools.count because next() is atomic in CPython and both
+        # the capture thread and the REPL thread generate filenames
+        self._fname_fmt = "photo_%Y%m%d_%H%M%S"
+        self._shot_seq = itertools.count(1)
+
+        # Non-blocking logging: emitting a record from the GPIO or writer
+        # thread just enqueues it; the listener thread owns the stdout
+        # lock and does the actual formatting/flushing
+        self._setup_logging()
         
         # Camera and state management
         self.picam2 = None
         self.is_running = False
         self.preview_active = False
-        
+        self._shutdown = threading.Event()
+        self._current_mode = None
+
+        # Background writer - JPEG encode and disk writes happen off the
+        # GPIO/input thread so the shutter path returns immediately
+        self._write_q = queue.Queue(maxsize=4)
+        self._dropped_writes = 0
+
+        # Shutter presses are only enqueued by the GPIO callback; this
+        # thread does the actual capture work
+        self._shutter_q = queue.Queue(maxsize=2)
+        self._dropped_presses = 0
+        self._capture_thread = threading.Thread(
+            target=self._capture_loop, daemon=True)
+        self._capture_thread.start()
+
+        # Pipeline counters for spotting the bottleneck stage; updated
+        # on the capture and writer threads, dumped on 's' and shutdown
+        self._metrics = {
+            "submitted": 0,
+            "completed": 0,
+            "queue_hwm": 0,
+            "enc_ewma_ms": 0.0,
+        }
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self._writer.start()
+
         # Create photos directory
         self._create_photos_dir()
         
@@ -45,137 +118,415 @@ class PiCameraController:
         # Initialize camera
         self._initialize_camera()
     
+    def _setup_logging(self):
+        """Route log records through a queue so emission never blocks"""
+        log_q = queue.SimpleQueue()
+        self._log_listener = logging.handlers.QueueListener(
+            log_q, logging.StreamHandler()
+        )
+        self._log_listener.start()
+        if not logger.handlers:
+            logger.addHandler(logging.handlers.QueueHandler(log_q))
+        logger.setLevel(logging.INFO)
+
     def _create_photos_dir(self):
         """Create photos directory if it doesn't exist"""
         if not os.path.exists(self.photos_dir):
             os.makedirs(self.photos_dir)
-            print(f"Created {self.photos_dir} directory")
+            logger.info("Created %s directory", self.photos_dir)
     
     def _setup_gpio(self):
         """Setup GPIO for button input"""
+        self._pi = None
+        self._button_cb = None
         try:
-            GPIO.setmode(GPIO.BCM)  # Use BCM pin numbering
-            GPIO.setup(self.button_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-            
-            # Add button press detection with debouncing
-            GPIO.add_event_detect(
-                self.button_pin, 
-                GPIO.FALLING, 
-                callback=self._button_pressed, 
-                bouncetime=300  # 300ms debounce
+            self._pi = pigpio.pi()
+            if not self._pi.connected:
+                raise RuntimeError("pigpio daemon not running (start with 'sudo pigpiod')")
+
+            self._pi.set_mode(self.button_pin, pigpio.INPUT)
+            self._pi.set_pull_up_down(self.button_pin, pigpio.PUD_UP)
+
+            # Hardware-timed debounce: edges shorter than 5ms are filtered
+            # out by the pigpio daemon's DMA sampling, so legitimate rapid
+            # presses still get through (unlike RPi.GPIO's bouncetime,
+            # which just throttles the callback rate)
+            self._pi.set_glitch_filter(self.button_pin, 5000)  # microseconds
+            self._button_cb = self._pi.callback(
+                self.button_pin,
+                pigpio.FALLING_EDGE,
+                lambda gpio, level, tick: self._button_pressed(gpio)
             )
-            print(f"GPIO button setup complete on pin {self.button_pin}")
-            
+            logger.info("GPIO button setup complete on pin %s", self.button_pin)
+
         except Exception as e:
-            print(f"Error setting up GPIO: {e}")
-            print("Button functionality will not be available")
+            logger.error("Error setting up GPIO: %s", e)
+            logger.warning("Button functionality will not be available")
     
     def _initialize_camera(self):
         """Initialize the camera with configurations"""
         try:
             self.picam2 = Picamera2()
             
-            # Preview configuration
-            self.preview_config = self.picam2.create_preview_configuration(
-                main={"size": self.preview_size},
-                lores={"size": (640, 480), "format": "YUV420"}
+            # Preview configuration; the lores stream is only configured
+            # when a consumer (e.g. downstream detection) asked for it
+            streams = {"main": {"size": self.preview_size}}
+            if self.enable_lores:
+                streams["lores"] = {"size": (640, 480), "format": "YUV420"}
+            self.preview_config = self.picam2.create_preview_configuration(**streams)
+
+            # Still configuration for full-resolution captures. Two
+            # buffers let the sensor expose the next frame while the
+            # first is read out (~70MB of CMA at 4056x3040 - raise
+            # dtoverlay cma if allocation fails); queue=False means a
+            # press grabs the freshest frame, not a stale queued one.
+            self.still_config = self.picam2.create_still_configuration(
+                main={"size": self.still_size},
+                buffer_count=2,
+                queue=False
             )
-            
-            print("Camera initialized successfully")
-            
+
+            # Post-processing parameters; grain_sigma is the noise
+            # standard deviation in 8-bit levels (0 disables grain)
+            self.grain_sigma = 6.0
+            self._rng = np.random.default_rng()
+
+            # Hardware-accelerated JPEG encoder, if available
+            self.jpeg_quality = 92
+            self._turbojpeg = None
+            if TurboJPEG is not None:
+                try:
+                    self._turbojpeg = TurboJPEG()
+                    logger.info("Using libjpeg-turbo for JPEG encoding")
+                except Exception as e:
+                    logger.info("libjpeg-turbo unavailable (%s), using default encoder", e)
+
+            logger.info("Camera initialized successfully")
+
         except Exception as e:
-            print(f"Error initializing camera: {e}")
+            logger.error("Error initializing camera: %s", e)
             raise
     
     def _button_pressed(self, channel):
         """
         Callback function for button press
-        
+
+        Runs on the pigpio callback thread, so it must not block: it
+        only posts the press to the capture thread and returns.
+
         Args:
             channel: GPIO channel that triggered the callback
         """
-        if self.is_running:
-            print("Button pressed - capturing photo!")
+        if not self.is_running:
+            return
+        try:
+            self._shutter_q.put_nowait(True)
+        except queue.Full:
+            self._dropped_presses += 1
+
+    def _capture_loop(self):
+        """Capture thread: fire the shutter for each queued press"""
+        while True:
+            press = self._shutter_q.get()
+            if press is None:
+                break
+            logger.debug("Button pressed - capturing photo")
             self.capture_photo()
     
     def start_preview(self):
         """Start the camera preview"""
         try:
             if not self.preview_active:
-                print("Starting camera preview...")
-                self.picam2.configure(self.preview_config)
+                logger.info("Starting camera preview...")
+                self._set_mode("preview")
                 self.picam2.start_preview(Preview.QTGL)
                 self.picam2.start()
                 self.preview_active = True
                 self.is_running = True
-                print("Preview started successfully")
+                logger.info("Preview started successfully")
             else:
-                print("Preview already active")
-                
+                logger.info("Preview already active")
+
         except Exception as e:
-            print(f"Error starting preview: {e}")
+            logger.error("Error starting preview: %s", e)
     
     def stop_preview(self):
         """Stop the camera preview"""
         try:
             if self.preview_active:
-                print("Stopping camera preview...")
+                logger.info("Stopping camera preview...")
                 self.picam2.stop_preview()
                 self.picam2.stop()
                 self.preview_active = False
-                print("Preview stopped")
+                logger.info("Preview stopped")
             else:
-                print("Preview not active")
-                
+                logger.info("Preview not active")
+
         except Exception as e:
-            print(f"Error stopping preview: {e}")
+            logger.error("Error stopping preview: %s", e)
     
-    def capture_photo(self):
+    def capture_photo(self, do_post=False):
         """
-        Capture a photo at current preview resolution
-        
+        Capture a full-resolution photo, handing the JPEG encode and disk
+        write to the background writer thread
+
+        Args:
+            do_post (bool): Apply post-processing on the writer thread
+                after the photo is saved
+
         Returns:
-            str: Path to captured photo file, or None if failed
+            str: Path the photo will be written to, or None if failed
         """
         try:
-            # Generate filename with timestamp
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{self.photos_dir}/photo_{timestamp}.jpg"
-            
-            print(f"Capturing photo: {filename}")
-            
-            # Simple capture without configuration switching to avoid event loop issues
-            self.picam2.capture_file(filename)
-            
-            # Get file info
-            if os.path.exists(filename):
-                file_size = os.path.getsize(filename) / (1024 * 1024)
-                print(f"Photo saved successfully: {filename}")
-                print(f"File size: {file_size:.1f} MB")
-                return filename
-            else:
-                print("Error: Photo file was not created")
+            filename = self._next_filename()
+
+            logger.debug("Capturing photo: %s", filename)
+
+            # Atomic mode switch inside picamera2 - grabs a full-resolution
+            # request without tearing down the preview pipeline, then
+            # returns to the previous mode automatically
+            request = self.picam2.switch_mode_and_capture_request(self.still_config)
+
+            try:
+                self._write_q.put_nowait((request, filename, do_post))
+                self._record_submit()
+            except queue.Full:
+                # Writer can't keep up - drop the frame rather than block
+                # the shutter path
+                request.release()
+                self._dropped_writes += 1
+                logger.warning("Write queue full - photo dropped (%d total)",
+                               self._dropped_writes)
                 return None
-                
+
+            return filename
+
         except Exception as e:
-            print(f"Error capturing photo: {e}")
+            logger.error("Error capturing photo: %s", e)
             return None
+
+    def capture_burst(self, n):
+        """
+        Capture n full-resolution photos back to back
+
+        Switches to the still configuration once, drains capture requests
+        straight into the write queue, then restores the previous mode.
+        Avoiding the per-shot mode switch leaves the capture rate limited
+        by the sensor/encoder pipeline rather than configure overhead.
+
+        Args:
+            n (int): Number of photos to capture
+
+        Returns:
+            list: Paths the photos will be written to
+        """
+        filenames = []
+        previous_mode = self._current_mode
+        try:
+            logger.info("Burst capture: %d photos", n)
+            self.picam2.switch_mode(self.still_config)
+            self._current_mode = "still"
+
+            for _ in range(n):
+                request = self.picam2.capture_request()
+                filename = self._next_filename()
+                # Block rather than drop - backpressure from the writer
+                # is what paces the burst
+                self._write_q.put((request, filename, False))
+                self._record_submit()
+                filenames.append(filename)
+
+        except Exception as e:
+            logger.error("Error during burst capture: %s", e)
+        finally:
+            if previous_mode == "preview":
+                self.picam2.switch_mode(self.preview_config)
+                self._current_mode = "preview"
+
+        return filenames
+
+    def _set_mode(self, mode):
+        """
+        Configure the camera for a named mode ("preview" or "still")
+
+        Tracks the active mode in a plain attribute so mode checks are a
+        Python read instead of a camera_configuration() call into the
+        libcamera bindings.
+        """
+        if self._current_mode == mode:
+            return
+        config = self.preview_config if mode == "preview" else self.still_config
+        self.picam2.configure(config)
+        self._current_mode = mode
+
+    def _next_filename(self):
+        """Generate the next timestamped photo path"""
+        seq = next(self._shot_seq)
+        stamp = time.strftime(self._fname_fmt)
+        return os.path.join(self.photos_dir, f"{stamp}_{seq:03d}.jpg")
+
+    def _writer_loop(self):
+        """
+        Writer thread: save queued capture requests to disk
+
+        Pops (request, filename) tuples from the write queue, saves the
+        main stream as JPEG and releases the request. Syncs are batched:
+        files are only fdatasync'd when the queue drains or sync_every
+        photos have accumulated, so a burst doesn't serialize on per-file
+        SD-card flushes. Exits on a None sentinel pushed by cleanup().
+        """
+        # The ring is created (and only ever touched) on this thread -
+        # io_uring rings must not be shared across threads
+        self._ring = None
+        if liburing is not None:
+            try:
+                self._ring = liburing.io_uring()
+                liburing.io_uring_queue_init(64, self._ring, 0)
+                logger.info("Using io_uring for batched syncs")
+            except Exception as e:
+                logger.info("io_uring unavailable (%s), using fdatasync", e)
+                self._ring = None
+
+        batch = []
+        while True:
+            item = self._write_q.get()
+            if item is None:
+                self._sync_batch(batch)
+                break
+            request, filename, do_post = item
+            try:
+                t0 = time.perf_counter()
+                self._save_request(request, filename, do_post)
+                dt_ms = (time.perf_counter() - t0) * 1000
+                self._metrics["completed"] += 1
+                self._metrics["enc_ewma_ms"] = (
+                    0.9 * self._metrics["enc_ewma_ms"] + 0.1 * dt_ms)
+                batch.append(filename)
+
+                # Get file info - one stat call instead of exists+getsize
+                try:
+                    st = os.stat(filename)
+                    logger.info("Photo saved: %s (%.1f MB)",
+                                filename, st.st_size / _MB)
+                except FileNotFoundError:
+                    logger.error("Photo file was not created: %s", filename)
+
+            except Exception as e:
+                logger.error("Error saving photo %s: %s", filename, e)
+            finally:
+                request.release()
+
+            if self._write_q.empty() or len(batch) >= self.sync_every:
+                self._sync_batch(batch)
+
+    def _record_submit(self):
+        """Count a queued capture and track the queue's high-water mark"""
+        self._metrics["submitted"] += 1
+        depth = self._write_q.qsize()
+        if depth > self._metrics["queue_hwm"]:
+            self._metrics["queue_hwm"] = depth
+
+    def _save_request(self, request, filename, do_post=False):
+        """
+        Encode a capture request's main stream to a JPEG file, applying
+        post-processing to the raw array first when requested
+        """
+        if do_post or self._turbojpeg is not None:
+            arr = request.make_array("main")
+            if do_post:
+                arr = self.apply_post_processing(arr)
+            self._encode_array(arr, filename)
+        else:
+            request.save("main", filename)
+
+    def _encode_array(self, arr, filename):
+        """
+        Write an image array as JPEG, via libjpeg-turbo (SIMD DCT on ARM
+        NEON) when available or Pillow otherwise
+        """
+        if self._turbojpeg is not None:
+            # make_array returns R,G,B byte order (picamera2 treats the
+            # "BGR888" main stream as PIL "RGB"); PyTurboJPEG defaults to
+            # BGR, so the pixel format must be spelled out
+            buf = self._turbojpeg.encode(arr, quality=self.jpeg_quality,
+                                         pixel_format=TJPF_RGB)
+            # 1MB buffer so a 10-20MB JPEG goes out in a handful of
+            # write() syscalls instead of thousands of 4KB chunks
+            with open(filename, "wb", buffering=_MB) as f:
+                f.write(buf)
+        else:
+            Image.fromarray(arr).save(filename, quality=self.jpeg_quality)
+
+    def _sync_batch(self, batch):
+        """Flush a batch of written photos to stable storage"""
+        if not batch:
+            return
+        if self._ring is not None:
+            self._sync_batch_uring(batch)
+        else:
+            for path in batch:
+                try:
+                    fd = os.open(path, os.O_RDONLY)
+                    try:
+                        os.fdatasync(fd)
+                    finally:
+                        os.close(fd)
+                except OSError as e:
+                    logger.error("Error syncing %s: %s", path, e)
+        batch.clear()
+
+    def _sync_batch_uring(self, batch):
+        """
+        Flush a batch through io_uring: one fdatasync SQE per file,
+        one submit syscall for the whole batch
+        """
+        fds = []
+        try:
+            for path in batch:
+                fds.append(os.open(path, os.O_RDONLY))
+            for fd in fds:
+                sqe = liburing.io_uring_get_sqe(self._ring)
+                liburing.io_uring_prep_fsync(
+                    sqe, fd, liburing.IORING_FSYNC_DATASYNC)
+            liburing.io_uring_submit(self._ring)
+
+            cqe = liburing.io_uring_cqe()
+            for _ in fds:
+                liburing.io_uring_wait_cqe(self._ring, cqe)
+                if cqe.res < 0:
+                    logger.error("io_uring fsync failed: %s",
+                                 os.strerror(-cqe.res))
+                liburing.io_uring_cqe_seen(self._ring, cqe)
+        except Exception as e:
+            logger.error("Error syncing batch via io_uring: %s", e)
+        finally:
+            for fd in fds:
+                os.close(fd)
     
-    def apply_post_processing(self, image_path):
+    def apply_post_processing(self, arr):
         """
-        Apply post-processing effects to an image
-        Placeholder for future implementation
-        
+        Apply post-processing effects to a captured frame
+
+        Effects must stay as whole-array NumPy operations (or a compiled
+        kernel): a 12MP frame is ~37M elements, so per-pixel Python loops
+        are off the table.
+
         Args:
-            image_path (str): Path to the image file
-            
+            arr (np.ndarray): HxWx3 uint8 image array
+
         Returns:
-            str: Path to processed image, or None if failed
+            np.ndarray: Processed uint8 image array
         """
-        # TODO: Implement grain, filters, and other effects
-        print(f"Post-processing placeholder for: {image_path}")
-        print("Future: Add grain, filters, vintage effects, etc.")
-        return image_path
+        # Film grain: a single vectorized noise pass in float32, clipped
+        # back to 8-bit. Future filters (LUTs via np.take, vignettes,
+        # etc.) should follow the same shape.
+        if self.grain_sigma > 0:
+            noise = self._rng.standard_normal(arr.shape, dtype=np.float32)
+            out = arr.astype(np.float32)
+            out += noise * self.grain_sigma
+            np.clip(out, 0, 255, out=out)
+            arr = out.astype(np.uint8)
+        return arr
     
     def get_camera_info(self):
         """
@@ -189,7 +540,7 @@ class PiCameraController:
                 return self.picam2.camera_properties
             return None
         except Exception as e:
-            print(f"Error getting camera info: {e}")
+            logger.error("Error getting camera info: %s", e)
             return None
     
     def run_interactive_mode(self):
@@ -210,35 +561,51 @@ class PiCameraController:
         
         print(f"\nCamera Preview Controls:")
         print("Press 'c' + Enter to capture a photo")
+        print("Press 'b [n]' + Enter to capture a burst (default 5)")
         print("Press 'q' + Enter to quit")
         print("Press 's' + Enter to show camera status")
         print(f"OR press the hardware button on GPIO {self.button_pin}")
         print("-" * 40)
-        
+
+        # Run the REPL on its own thread so a pending input() never
+        # delays the GPIO shutter path; the main thread just waits for
+        # shutdown
+        threading.Thread(target=self._repl_loop, daemon=True).start()
+
         try:
-            while self.is_running:
-                command = input("Command (c/s/q): ").lower().strip()
-                
-                if command == 'c':
-                    filename = self.capture_photo()
-                    if filename:
-                        # Placeholder for post-processing
-                        self.apply_post_processing(filename)
-                        
-                elif command == 's':
-                    self._show_status()
-                    
-                elif command == 'q':
-                    print("Quitting...")
-                    self.is_running = False
-                    break
-                    
-                else:
-                    print("Invalid command. Use 'c' to capture, 's' for status, 'q' to quit.")
-                    
+            self._shutdown.wait()
         except KeyboardInterrupt:
             print("\nShutting down...")
+        finally:
             self.is_running = False
+
+    def _repl_loop(self):
+        """Read and dispatch interactive commands until quit"""
+        while self.is_running:
+            try:
+                command = input("Command (c/b/s/q): ").lower().strip()
+            except EOFError:
+                command = 'q'
+
+            if command == 'c':
+                self.capture_photo(do_post=True)
+
+            elif command.startswith('b'):
+                parts = command.split()
+                n = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 5
+                self.capture_burst(n)
+
+            elif command == 's':
+                self._show_status()
+
+            elif command == 'q':
+                print("Quitting...")
+                self.is_running = False
+                self._shutdown.set()
+                break
+
+            else:
+                print("Invalid command. Use 'c' to capture, 'b' for burst, 's' for status, 'q' to quit.")
     
     def _show_status(self):
         """Show current camera status"""
@@ -249,24 +616,49 @@ class PiCameraController:
         print(f"  Button pin: {self.button_pin}")
         print(f"  Preview size: {self.preview_size}")
         print(f"  Still size: {self.still_size}")
+        print(f"  Captures submitted: {self._metrics['submitted']}")
+        print(f"  Presses dropped: {self._dropped_presses}")
+        print(f"  Writes completed: {self._metrics['completed']}")
+        print(f"  Writes dropped: {self._dropped_writes}")
+        print(f"  Write queue high-water mark: {self._metrics['queue_hwm']}")
+        print(f"  Encode+write EWMA: {self._metrics['enc_ewma_ms']:.1f} ms")
     
     def cleanup(self):
         """Clean up resources"""
         try:
-            print("Cleaning up...")
+            logger.info("Cleaning up...")
             self.is_running = False
-            
+
+            # Stop taking presses, then drain the writer so queued
+            # photos hit the disk
+            self._shutter_q.put(None)
+            self._capture_thread.join()
+            self._write_q.put(None)
+            self._writer.join()
+
+            logger.info(
+                "Pipeline stats: %d submitted, %d completed, %d dropped, "
+                "queue high-water %d, encode+write EWMA %.1f ms",
+                self._metrics["submitted"], self._metrics["completed"],
+                self._dropped_writes, self._metrics["queue_hwm"],
+                self._metrics["enc_ewma_ms"])
+
             if self.preview_active:
                 self.stop_preview()
             
             if self.picam2:
                 self.picam2.close()
-            
-            GPIO.cleanup()
-            print("Cleanup completed successfully")
-            
+
+            if self._button_cb:
+                self._button_cb.cancel()
+            if self._pi:
+                self._pi.stop()
+
+            logger.info("Cleanup completed successfully")
+            self._log_listener.stop()
+
         except Exception as e:
-            print(f"Error during cleanup: {e}")
+            logger.error("Error during cleanup: %s", e)
 
 
 def main():